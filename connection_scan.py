@@ -1,25 +1,116 @@
-from typing import Dict, List
-from datetime import datetime, timedelta
+from bisect import bisect_left
+from collections import deque
+from itertools import islice
+from typing import Deque, Dict, List, Optional
+from datetime import datetime
 import math
 
+import numpy as np
 import pandas as pd
 from scipy.sparse import csr_matrix
 
-from connections import Connection, Footpath
+from connections import Connection
 from distribution import Distribution
 from journey_pointer import JourneyPointer
 from journey_parser import find_resulting_paths
 from sorted_lists import SortedJourneyList
+from time_utils import to_minutes
 
+NANOSECONDS_PER_MINUTE = 60 * 10 ** 9
 
-def min_to_timedelta(minutes: float) -> timedelta:
+
+def series_to_minutes(times: pd.Series, round_up: bool = False) -> List[int]:
+    """
+    Converts a column of datetimes to the number of minutes elapsed since the epoch, rounded down unless round_up.
+
+    :param times: the datetimes to convert. If they are timezone-aware, they are converted to UTC
+    :param round_up: whether to round partial minutes up instead of down
+    :return: the number of minutes since the epoch for each datetime, in order
     """
-    Creates a timedelta object from a ceiled number of minutes.
+    times = pd.to_datetime(times)
+    if times.dt.tz is not None:
+        times = times.dt.tz_convert('UTC').dt.tz_localize(None)
+    nanoseconds = times.to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    if round_up:
+        return (-(-nanoseconds // NANOSECONDS_PER_MINUTE)).tolist()
+    return (nanoseconds // NANOSECONDS_PER_MINUTE).tolist()
+
 
-    :param minutes: the number of minutes to ceil and transform to a timedelta object
-    :return: the number of minutes, ceiled to the nearest integer
+class ScanContext(object):
     """
-    return timedelta(minutes=math.ceil(minutes))
+    The columns of the connections and the footpaths used by the Connection Scan Algorithm, extracted once so that the
+    same timetable can be queried for several (source, destination) pairs without converting the DataFrame again.
+
+    Attributes:
+    - :class:`int` n_stops --> The number of stops, i.e. the number of rows of the footpath matrix.
+    - :class:`List[int]` fp_indptr, fp_indices, fp_walk_times --> The footpath matrix in CSR format, with walking
+        times ceiled to minutes. The footpaths leaving stop i are at positions fp_indptr[i] to fp_indptr[i + 1].
+    - :class:`List[Any]` trip_ids --> The trip id of each connection.
+    - :class:`List[int]` trip_codes --> A dense integer code for the trip of each connection.
+    - :class:`int` n_trips --> The number of distinct trips.
+    - :class:`List[str]` route_descs --> The mode of transport of each connection.
+    - :class:`List[int]` src_ids, dst_ids --> The departure and arrival stops of each connection.
+    - :class:`List[int]` dep_times, arr_times --> The departure and arrival times of each connection, in minutes since
+        the epoch.
+    - :class:`List[int]` distribution_ids --> The id of the delay distribution of each connection.
+    - :class:`List[int]` neg_dep_times --> The negated departure times, in ascending order, so that the connections can
+        be binary searched by departure time.
+    """
+
+    def __init__(self, df_connections: pd.DataFrame, footpaths: csr_matrix):
+        """
+        :param df_connections: the connections, as described in connection_scan
+        :param footpaths: the footpaths, as described in connection_scan
+        """
+        # Ceil all walking times to minutes once, rather than every time a footpath is considered
+        walk_minutes = footpaths.ceil().astype(np.int64)
+        self.n_stops = footpaths.shape[0]
+        self.fp_indptr = walk_minutes.indptr.tolist()
+        self.fp_indices = walk_minutes.indices.tolist()
+        self.fp_walk_times = walk_minutes.data.tolist()
+
+        # Extract the columns once, as iterating over plain lists is much cheaper than building a row object per
+        # connection. The mode of transport is optional.
+        n_connections = len(df_connections)
+
+        # Trips are also identified by dense integer codes, so that the first connection taken in each trip (i.e., its
+        # exit connection) can be stored in a list rather than in a dictionary keyed by trip id. The trip ids (and the
+        # modes of transport) are rebuilt from the distinct values, so that all connections of a trip share the same
+        # object and comparing ids of the same trip short-circuits on identity. Neither column has missing values.
+        trip_codes, unique_trip_ids = pd.factorize(df_connections['trip_id'])
+        unique_trip_ids = unique_trip_ids.tolist()
+        self.trip_codes = trip_codes.tolist()
+        self.trip_ids = [unique_trip_ids[trip_code] for trip_code in self.trip_codes]
+        self.n_trips = len(unique_trip_ids)
+        if 'route_desc' in df_connections.columns:
+            route_codes, unique_route_descs = pd.factorize(df_connections['route_desc'])
+            unique_route_descs = unique_route_descs.tolist()
+            self.route_descs = [unique_route_descs[route_code] for route_code in route_codes.tolist()]
+        else:
+            self.route_descs = ['unknown'] * n_connections
+        self.src_ids = df_connections['src_id'].tolist()
+        self.dst_ids = df_connections['dst_id'].tolist()
+        # Partial minutes are rounded so that connections are never assumed to be easier to catch than they are: a
+        # departure is rounded down, and an arrival up
+        self.dep_times = series_to_minutes(df_connections['departure_time_dt'])
+        self.arr_times = series_to_minutes(df_connections['arrival_time_dt'], round_up=True)
+        self.distribution_ids = df_connections['distr_id'].tolist()
+        self.neg_dep_times = [-dep_time for dep_time in self.dep_times]
+
+    def __len__(self):
+        return len(self.trip_ids)
+
+    def first_departing_at_or_before(self, t: int) -> int:
+        """
+        Binary searches the connections, which are sorted in descending order of departure.
+
+        :param t: a time, in minutes since the epoch
+        :return: the index of the first connection departing at or before t (the number of connections if there is none)
+        """
+        return bisect_left(self.neg_dep_times, -t)
+
+    def __repr__(self):
+        return f'<ScanContext of {len(self)} connections and {self.n_stops} stops>'
 
 
 def connection_scan(df_connections: pd.DataFrame,
@@ -33,10 +124,14 @@ def connection_scan(df_connections: pd.DataFrame,
                     min_chance_of_success: float,
                     journeys_per_stop: int = 2,
                     min_times_to_find_source: int = 3,
-                    max_recursion: int = 8):
+                    max_recursion: int = 8,
+                    max_journey_duration: Optional[int] = None):
     """
     Custom Connection Scan Algorithm, which operates in reverse order.
 
+    To run several queries on the same connections and footpaths, build a ScanContext once and call
+    connection_scan_from_context instead.
+
     :param df_connections: Each row represents a connection (an edge in the graph). The rows are sorted in descending
         order with respect to the departure times of the connections. It should contain no edges for which the arrival
         time is later than the user's target arrival time. Should contain the columns:
@@ -47,12 +142,15 @@ def connection_scan(df_connections: pd.DataFrame,
             * 'trip_id': Any. the ID of the trip to which this connection belongs
             * 'route_desc': str. the mode of transport of the trip (e.g., 'bus', 'train', ...)
             * 'distr_id': int. The id of the distribution of delays for this distribution
+        Times are handled in whole minutes: departures are rounded down and arrivals up. Timezone-aware times are
+        converted to UTC, and the times of the returned journeys are then naive UTC times.
     :param footpaths: A sparse matrix containing the footpaths in the map. Row i contains the stops reachable from stop
         i by foot. There should be no self-loops (i <-> i).
     :param delay_distributions: maps distribution delay groups to their distributions
     :param source: The index of the stop from which the user wants to depart.
     :param destination: The index of the stop where the user wants to go.
-    :param target_arrival: The time at which the user wants to arrive to their target destination.
+    :param target_arrival: The time at which the user wants to arrive to their target destination (rounded down to
+        the minute, and converted to UTC if it is timezone-aware).
     :param time_per_connection: The amount of time (in minutes) it takes for the user to change transportation vehicles
         at a stop (i.e., the amount of time it takes to change tracks at a train station).
     :param journeys_to_find: The minimum number of possible Journeys to find (if possible, as if there are not enough edges
@@ -62,124 +160,195 @@ def connection_scan(df_connections: pd.DataFrame,
     :param min_times_to_find_source: The minimum number of times the source must be found before returning the Journeys
         (if possible, as if there are not enough edges in the DataFrame, it will be found fewer times).
     :param max_recursion: the maximum number of segments that can be in a journey
+    :param max_journey_duration: If given, the maximum duration of a journey in minutes: connections departing more
+        than this amount of time before the target arrival are not scanned.
+    :return: A list containing all Journeys found.
+    """
+    return connection_scan_from_context(
+        ScanContext(df_connections, footpaths), delay_distributions, source, destination, target_arrival,
+        time_per_connection, journeys_to_find, min_chance_of_success, journeys_per_stop, min_times_to_find_source,
+        max_recursion, max_journey_duration
+    )
+
+
+def connection_scan_from_context(context: ScanContext,
+                                 delay_distributions: Dict[int, Distribution],
+                                 source: int,
+                                 destination: int,
+                                 target_arrival: datetime,
+                                 time_per_connection: int,
+                                 journeys_to_find: int,
+                                 min_chance_of_success: float,
+                                 journeys_per_stop: int = 2,
+                                 min_times_to_find_source: int = 3,
+                                 max_recursion: int = 8,
+                                 max_journey_duration: Optional[int] = None):
+    """
+    Custom Connection Scan Algorithm, which operates in reverse order, on connections and footpaths that were already
+    extracted into a ScanContext. The context is not modified, so it can be reused for other queries, including queries
+    with other target arrival times: connections departing after the target arrival time are skipped.
+
+    :param context: the connections and footpaths to scan (see connection_scan for the requirements on them)
+    :param delay_distributions: maps distribution delay groups to their distributions
+    :param source: The index of the stop from which the user wants to depart.
+    :param destination: The index of the stop where the user wants to go.
+    :param target_arrival: The time at which the user wants to arrive to their target destination (rounded down to
+        the minute, and converted to UTC if it is timezone-aware).
+    :param time_per_connection: The amount of time (in minutes) it takes for the user to change transportation vehicles
+        at a stop (i.e., the amount of time it takes to change tracks at a train station).
+    :param journeys_to_find: The minimum number of possible Journeys to find (if possible, as if there are not enough
+        connections in the context, fewer journeys will be returned)
+    :param min_chance_of_success: the minimum probability of success a journey should have to be kept
+    :param journeys_per_stop: The maximum number of JourneyPointers to store at each stop.
+    :param min_times_to_find_source: The minimum number of times the source must be found before returning the Journeys
+        (if possible, as if there are not enough connections in the context, it will be found fewer times).
+    :param max_recursion: the maximum number of segments that can be in a journey
+    :param max_journey_duration: If given, the maximum duration of a journey in minutes: connections departing more
+        than this amount of time before the target arrival are not scanned.
     :return: A list containing all Journeys found.
     """
+    # The stops from which journeys are looked for, and the number of times any of them was found
+    sources = {source}
     source_found_n_times = 0
 
-    journey_pointers: Dict[int, SortedJourneyList] = {}
-    trip_taken: Dict[str, Connection] = {}
+    # The journeys found from the journey pointers only change if a journey pointer was kept since they were last
+    # computed: other updates (e.g., to trip_connections) only concern connections that no journey pointer leads to.
+    paths_found = None
+    journey_pointers_updated = True
+
+    # All times are handled in minutes since the epoch during the scan
+    target_arrival = to_minutes(target_arrival)
+
+    # The time needed to change vehicles is the same for every connection, ceil it once
+    connection_time = math.ceil(time_per_connection)
 
-    # A dictionary mapping trip ids to a list of connections in the trip that were found and can be taken
-    trip_connections: Dict[str, List[Connection]] = {}
+    # The footpaths leaving stop i are read directly from the CSR arrays, at positions fp_indptr[i] to fp_indptr[i + 1]
+    fp_indptr = context.fp_indptr
+    fp_indices = context.fp_indices
+    fp_walk_times = context.fp_walk_times
+
+    # Walking to the departure stop of a connection also requires the time to change vehicles
+    fp_transfer_times = [walk_time + connection_time for walk_time in fp_walk_times]
+
+    # The journey pointers of each stop, indexed by stop. Stops index the rows of the footpath matrix.
+    journey_pointers: List[SortedJourneyList] = [SortedJourneyList([]) for _ in range(context.n_stops)]
+
+    # The connections in each trip that were found and can be taken, in order, indexed by trip code (None for trips
+    # none of whose connections were found yet). As connections are scanned in descending order of departure, they are
+    # always added at the front.
+    trip_connections: List[Optional[Deque[Connection]]] = [None] * context.n_trips
 
     # Set the latest arrival time at the destination to the target time
     journey_pointers[destination] = SortedJourneyList([JourneyPointer(target_arrival, None, None, None)])
 
     # For all stops that we can walk to from the destination, update the latest possible arrival time
-    destination_footpaths = footpaths.getrow(destination)
-    for train_stop, walking_time_float in zip(destination_footpaths.indices, destination_footpaths.data):
-
-        # Ceil the walking time to minutes, create timedelta object
-        walk_time = min_to_timedelta(walking_time_float)
-        path = Footpath(train_stop, destination, walk_time)
-
+    start, end = fp_indptr[destination], fp_indptr[destination + 1]
+    for train_stop, walk_time in zip(fp_indices[start:end], fp_walk_times[start:end]):
         # Latest arrival time is time you must be
         latest_arrival = target_arrival - walk_time
 
         # Add the journey pointer to the latest arrival times for the train stop
-        journey_pointers[train_stop] = SortedJourneyList([JourneyPointer(latest_arrival, None, None, path)])
+        journey_pointers[train_stop] = SortedJourneyList([JourneyPointer(latest_arrival, None, None, walk_time)])
 
-    # Iterate over connections in the network
-    for idx, row in df_connections.iterrows():
-        route_desc = row.get('route_desc', 'unknown')
-        dep_time = row.get('departure_time_dt')
-        arr_time = row.get('arrival_time_dt')
-        distribution_id = row.get('distr_id')
-        c = Connection(row.trip_id, route_desc, row.src_id, row.dst_id, dep_time, arr_time, distribution_id)
-
-        # Update the connections that can be taken in the trip
-        c_trip_connections = trip_connections.get(c.trip_id)
-        if c_trip_connections is None:
-            c_trip_connections = [c]
-        else:
-            c_trip_connections = [c] + c_trip_connections
-        trip_connections[c.trip_id] = c_trip_connections
+    # The first connection taken in each trip (i.e., its exit connection), indexed by trip code
+    trip_taken: List[Optional[Connection]] = [None] * context.n_trips
+
+    # Connections are sorted in descending order of departure. The ones departing after the target arrival time cannot
+    # be taken (they arrive too late, and so do all connections scanned before them), and the ones departing too early
+    # to be part of a journey are all at the end: binary search for both, and only scan the connections in between
+    first_feasible = context.first_departing_at_or_before(target_arrival)
+    n_feasible = len(context)
+    if max_journey_duration is not None:
+        earliest_departure = target_arrival - max_journey_duration
+        n_feasible = context.first_departing_at_or_before(earliest_departure - 1)
 
-        trip_can_be_taken = trip_taken.get(c.trip_id)
-        arr_stop_req_arrival_times = journey_pointers.get(c.arr_stop, SortedJourneyList([]))
+    # Iterate over connections in the network
+    connection_columns = islice(zip(
+        context.trip_ids, context.trip_codes, context.route_descs, context.src_ids, context.dst_ids,
+        context.dep_times, context.arr_times, context.distribution_ids
+    ), first_feasible, n_feasible)
+    for trip_id, trip_code, route_desc, src_id, dst_id, dep_time, arr_time, distribution_id in connection_columns:
+        trip_can_be_taken = trip_taken[trip_code]
+        arr_stop_req_arrival_times = journey_pointers[dst_id]
 
         # A connection can be taken if either:
         #   * the connection's trip can be taken
         #   * the connection gets you to the next stop before its latest arrival time (i.e. the arrival time of the
         #     connection is earlier than the time at which you need to arrive). If there is no required arrival time, it
         #     is assumed to be -infinity, and hence a user cannot get there in time.
+        # The check is done on the raw column values, so that no Connection is created for the (many) connections that
+        # cannot be taken.
         if (trip_can_be_taken is not None or (
                 len(arr_stop_req_arrival_times) > 0 and
-                arr_stop_req_arrival_times[0].arrival_time >= c.arr_time)):
+                arr_stop_req_arrival_times.arrival_times[0] >= arr_time)):
+
+            c = Connection(trip_id, route_desc, src_id, dst_id, dep_time, arr_time, distribution_id, trip_code)
+
+            # Update the connections that can be taken in the trip. The connections of the trip that were scanned
+            # before it could be taken come after its exit connection, so they are never needed.
+            c_trip_connections = trip_connections[trip_code]
+            if c_trip_connections is None:
+                c_trip_connections = deque()
+                trip_connections[trip_code] = c_trip_connections
+            c.trip_position = len(c_trip_connections)
+            c_trip_connections.appendleft(c)
 
             if trip_can_be_taken is None:
-                trip_taken[c.trip_id] = c
+                trip_taken[trip_code] = c
+            exit_connection = trip_taken[trip_code]
 
             # Update the latest arrival time for c.dep_stop, as arriving at c.dep_stop allows you to arrive to
-            # c.arr_stop before you need to be there
-            dep_stop_req_arrival_times = journey_pointers.get(c.dep_stop)
-            if dep_stop_req_arrival_times is None:
-                dep_stop_req_arrival_times = SortedJourneyList([])
-                journey_pointers[c.dep_stop] = dep_stop_req_arrival_times
-
-            dep_stop_latest_arr_time = c.dep_time - min_to_timedelta(time_per_connection)
-            dep_stop_req_arrival_times.append(
-                JourneyPointer(dep_stop_latest_arr_time, c, trip_taken[c.trip_id], None)
-            )
-
-            if len(dep_stop_req_arrival_times) > journeys_per_stop:
-                dep_stop_req_arrival_times.remove_earliest_arrival()
-
-            # If the source was found and it is the required number of times, try to generate the journeys
-            if c.dep_stop == source:
+            # c.arr_stop before you need to be there. Most pointers would be rejected by the bounded list, so they are
+            # only created once it is known that they will be kept
+            dep_stop_req_arrival_times = journey_pointers[c.dep_stop]
+            dep_stop_latest_arr_time = c.dep_min - connection_time
+            if dep_stop_req_arrival_times.accepts(dep_stop_latest_arr_time, journeys_per_stop):
+                dep_stop_req_arrival_times.replace_or_insert(
+                    JourneyPointer(dep_stop_latest_arr_time, c, exit_connection, None), journeys_per_stop
+                )
+                journey_pointers_updated = True
+
+            # If the source was found and it is the required number of times, try to generate the journeys (unless
+            # they are the same as the last time they were generated)
+            if c.dep_stop in sources:
                 source_found_n_times += 1
-                if source_found_n_times >= min_times_to_find_source:
+                if source_found_n_times >= min_times_to_find_source and journey_pointers_updated:
                     paths_found = find_resulting_paths(
                         source, destination, target_arrival, time_per_connection, journey_pointers, trip_connections,
                         delay_distributions, min_chance_of_success, max_recursion
                     )
+                    journey_pointers_updated = False
                     if len(paths_found) >= journeys_to_find:
                         return paths_found
 
             # Iterate over stops we can walk to from the departure, as arriving there and walking to c.dep_stop can get
             # you to the destination
-            neighbor_stops = footpaths.getrow(c.dep_stop)
-            for train_stop, walking_time_float in zip(neighbor_stops.indices, neighbor_stops.data):
+            start, end = fp_indptr[c.dep_stop], fp_indptr[c.dep_stop + 1]
+            for train_stop, walk_time in zip(fp_indices[start:end], fp_transfer_times[start:end]):
+                neighbor_req_arrival_times = journey_pointers[train_stop]
+                latest_arrival = c.dep_min - walk_time
 
-                neighbor_req_arrival_times = journey_pointers.get(train_stop)
-                if neighbor_req_arrival_times is None:
-                    neighbor_req_arrival_times = SortedJourneyList([])
-                    journey_pointers[train_stop] = neighbor_req_arrival_times
-
-                walk_time = min_to_timedelta(walking_time_float + time_per_connection)
-                path = Footpath(train_stop, c.dep_stop, walk_time)
-                latest_arrival = c.dep_time - walk_time
-
-                neighbor_req_arrival_times.append(
-                    JourneyPointer(latest_arrival, c, trip_taken[c.trip_id], path)
-                )
-
-                if len(neighbor_req_arrival_times) > journeys_per_stop:
-                    neighbor_req_arrival_times.remove_earliest_arrival()
+                if neighbor_req_arrival_times.accepts(latest_arrival, journeys_per_stop):
+                    neighbor_req_arrival_times.replace_or_insert(
+                        JourneyPointer(latest_arrival, c, exit_connection, walk_time), journeys_per_stop
+                    )
+                    journey_pointers_updated = True
 
-                if train_stop == source:
+                if train_stop in sources:
                     source_found_n_times += 1
-                    if source_found_n_times >= min_times_to_find_source:
+                    if source_found_n_times >= min_times_to_find_source and journey_pointers_updated:
                         paths_found = find_resulting_paths(
                             source, destination, target_arrival, time_per_connection, journey_pointers,
                             trip_connections, delay_distributions, min_chance_of_success, max_recursion
                         )
+                        journey_pointers_updated = False
                         if len(paths_found) >= journeys_to_find:
                             return paths_found
 
     # If the source was not found the required number of times, still try to find paths.
-    paths_found = find_resulting_paths(
-        source, destination, target_arrival, time_per_connection, journey_pointers, trip_connections,
-        delay_distributions, min_chance_of_success, max_recursion
-    )
+    if journey_pointers_updated:
+        paths_found = find_resulting_paths(
+            source, destination, target_arrival, time_per_connection, journey_pointers, trip_connections,
+            delay_distributions, min_chance_of_success, max_recursion
+        )
     return paths_found
@@ -1,4 +1,12 @@
 from datetime import datetime, timedelta
+from typing import Optional
+
+from time_utils import from_minutes
+
+# The kinds of journey segments, stored in the kind class attribute of Footpath and TripSegment so that the segments of
+# a Journey can be told apart with an integer comparison rather than with isinstance
+FOOTPATH = 0
+TRIP_SEGMENT = 1
 
 
 class Connection(object):
@@ -7,18 +15,30 @@ class Connection(object):
 
     Attributes:
     - :class:`Any` trip_id --> the id of the trip to which this segment belongs.
+    - :class:`Optional[int]` trip_code --> a dense integer identifying the trip, given by the Connection Scan
+        Algorithm so that trips can be compared and looked up with integers.
     - :class:`str` transport_type --> type of transport along this trip (e.g., 'train', 'bus', ...)
     - :class:`int` dep_stop --> the index of the departure stop of the connection
     - :class:`int` arr_stop --> the index of the arrival stop of the connection
-    - :class:`datetime.datetime` dep_time --> the time at which the connection leaves the departure stop
-    - :class:`datetime.datetime` arr_time --> the time at which the connection arrives to the arrival stop
+    - :class:`int` dep_min --> the time at which the connection leaves the departure stop, in minutes since the epoch
+    - :class:`int` arr_min --> the time at which the connection arrives to the arrival stop, in minutes since the epoch
     - :class:`int` distribution_id --> the delay distribution id for this connection
+    - :class:`Optional[int]` trip_position --> the number of connections of the same trip found before this one by the
+        Connection Scan Algorithm (i.e., departing after it). As connections are added at the front of the connections
+        of their trip, this is the position of the connection counted from the back. None until the connection is found.
+
+    The times are also available as datetimes through the dep_time and arr_time properties, which are meant for display:
+    the algorithms use the integer times.
     """
 
-    def __init__(self, trip_id: str, ttype: str, dep_stop: int, arr_stop: int, dep_time: datetime, arr_time: datetime,
-                 distribution_id: int):
+    __slots__ = ('trip_id', 'trip_code', 'transport_type', 'dep_stop', 'arr_stop', 'dep_min', 'arr_min',
+                 'distribution_id', 'trip_position')
+
+    def __init__(self, trip_id: str, ttype: str, dep_stop: int, arr_stop: int, dep_min: int, arr_min: int,
+                 distribution_id: int, trip_code: Optional[int] = None):
         # Trip information
         self.trip_id = trip_id
+        self.trip_code = trip_code
         self.transport_type = ttype
 
         # Departure and arrival stop indices
@@ -26,19 +46,37 @@ class Connection(object):
         self.arr_stop = arr_stop
 
         # Departure and arrival times
-        self.dep_time = dep_time
-        self.arr_time = arr_time
+        self.dep_min = dep_min
+        self.arr_min = arr_min
 
         # Delay distribution group
         self.distribution_id = distribution_id
 
+        # Position in the trip, set when the connection is found by the Connection Scan Algorithm
+        self.trip_position = None
+
+    @property
+    def dep_time(self) -> datetime:
+        """
+        :return: the time at which the connection leaves the departure stop
+        """
+        return from_minutes(self.dep_min)
+
+    @property
+    def arr_time(self) -> datetime:
+        """
+        :return: the time at which the connection arrives to the arrival stop
+        """
+        return from_minutes(self.arr_min)
+
     def __repr__(self):
-        return f'<Connection ({self.dep_stop} -> {self.dep_stop}), ({self.dep_time} -> {self.arr_time})>'
+        return f'<Connection ({self.dep_stop} -> {self.arr_stop}), ' \
+               f'({from_minutes(self.dep_min)} -> {from_minutes(self.arr_min)})>'
 
     def __str__(self):
         return f'{self.transport_type} Connection on trip {self.trip_id}' \
-               f' from ({self.dep_stop} -> {self.dep_stop})' \
-               f' at ({self.dep_time} -> {self.arr_time})'
+               f' from ({self.dep_stop} -> {self.arr_stop})' \
+               f' at ({from_minutes(self.dep_min)} -> {from_minutes(self.arr_min)})'
 
 
 class TripSegment(object):
@@ -50,26 +88,52 @@ class TripSegment(object):
     - :class:`str` transport_type --> type of transport along this trip (e.g., 'train', 'bus', ...)
     - :class:`Connection` enter_connection --> the first connection in the trip that the user takes
     - :class:`Connection` exit_connection --> the last connection in the trip that the user takes
-    - :class:`datetime.datetime` departure_time --> the departure time of the segment
-    - :class:`datetime.datetime` arrival_time --> the arrival time of the segment
+    - :class:`int` departure_min --> the departure time of the segment, in minutes since the epoch
+    - :class:`int` arrival_min --> the arrival time of the segment, in minutes since the epoch
+    - :class:`int` distribution_id --> the delay distribution id for the arrival connection of the trip segment
+
+    - :class:`int` kind --> TRIP_SEGMENT, shared by all trip segments
+
+    The times are also available as datetimes through the departure_time and arrival_time properties.
     """
 
+    __slots__ = ('trip_id', 'transport_type', 'enter_connection', 'exit_connection', 'departure_min', 'arrival_min',
+                 'distribution_id')
+
+    kind = TRIP_SEGMENT
+
     def __init__(self, enter_connection: Connection, exit_connection: Connection):
         self.trip_id = enter_connection.trip_id
         self.transport_type = enter_connection.transport_type
         self.enter_connection = enter_connection
         self.exit_connection = exit_connection
-        self.departure_time = enter_connection.dep_time
-        self.arrival_time = exit_connection.arr_time
+        self.departure_min = enter_connection.dep_min
+        self.arrival_min = exit_connection.arr_min
+        self.distribution_id = exit_connection.distribution_id
+
+    @property
+    def departure_time(self) -> datetime:
+        """
+        :return: the departure time of the segment
+        """
+        return from_minutes(self.departure_min)
+
+    @property
+    def arrival_time(self) -> datetime:
+        """
+        :return: the arrival time of the segment
+        """
+        return from_minutes(self.arrival_min)
 
     def __repr__(self):
         return f'<TripSegment ({self.trip_id}, {self.enter_connection.dep_stop} -> {self.exit_connection.arr_stop})>'
 
     def __str__(self):
-        s = f'TripSegment of trip {self.trip_id}'
-        s += f'  from {self.enter_connection.dep_stop} to {self.exit_connection.arr_stop}'
-        s += f'  departure {self.enter_connection.dep_time}, arrival {self.exit_connection.arr_time}'
-        return s
+        return ''.join((
+            f'TripSegment of trip {self.trip_id}',
+            f'  from {self.enter_connection.dep_stop} to {self.exit_connection.arr_stop}',
+            f'  departure {from_minutes(self.departure_min)}, arrival {from_minutes(self.arrival_min)}',
+        ))
 
     def entry_stop(self) -> int:
         """
@@ -87,7 +151,7 @@ class TripSegment(object):
         """
         :return: the delay distribution id for the arrival connection of the trip segment
         """
-        return self.exit_connection.distribution_id
+        return self.distribution_id
 
 
 class Footpath(object):
@@ -97,19 +161,33 @@ class Footpath(object):
     Attributes:
     - :class:`int` dep_stop --> the index of the departure stop of the footpath
     - :class:`int` arr_stop --> the index of the arrival stop of the footpath
-    - :class:`datetime.timedelta` walk_time --> the duration it takes to walk between the stops.
+    - :class:`int` walk_min --> the duration it takes to walk between the stops, in minutes.
+    - :class:`int` kind --> FOOTPATH, shared by all footpaths
+
+    The duration is also available as a timedelta through the walk_time property.
     """
 
-    def __init__(self, dep_stop: int, arr_stop: int, walk_time: timedelta):
+    __slots__ = ('dep_stop', 'arr_stop', 'walk_min')
+
+    kind = FOOTPATH
+
+    def __init__(self, dep_stop: int, arr_stop: int, walk_min: int):
         # Departure and arrival stop indices
         self.dep_stop = dep_stop
         self.arr_stop = arr_stop
 
         # Walk time between the stops
-        self.walk_time = walk_time
+        self.walk_min = walk_min
+
+    @property
+    def walk_time(self) -> timedelta:
+        """
+        :return: the duration it takes to walk between the stops
+        """
+        return timedelta(minutes=self.walk_min)
 
     def __repr__(self):
-        return f'<Footpath ({self.dep_stop} -> {self.arr_stop}), {self.walk_time}>'
+        return f'<Footpath ({self.dep_stop} -> {self.arr_stop}), {self.walk_min} min>'
 
     def __str__(self):
-        return f'Footpath from {self.dep_stop} to {self.arr_stop}, {self.walk_time.seconds//60} minutes'
+        return f'Footpath from {self.dep_stop} to {self.arr_stop}, {self.walk_min} minutes'
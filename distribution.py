@@ -1,6 +1,13 @@
+from bisect import bisect_right
+from itertools import accumulate
+
+# The CDF of the delays up to this number of minutes is tabulated, larger delays are looked up with a binary search
+MAX_TABULATED_DELAY = 24 * 60
 
 
 class Distribution(object):
+    __slots__ = ('times', 'probas', 'id', '_sorted_times', '_cum_probas', '_cdf_by_minute')
+
     def __init__(self, times: list, probas: list, distr_id: int):
         """
         Creates a distribution object
@@ -27,6 +34,17 @@ class Distribution(object):
         self.probas = probas
         self.id = distr_id
 
+        # The delays in increasing order, and the probability of having at most each of them, so that the CDF can be
+        # looked up with a binary search
+        order = sorted(range(len(times)), key=lambda i: times[i])
+        self._sorted_times = [times[i] for i in order]
+        self._cum_probas = list(accumulate(probas[i] for i in order))
+
+        # The delays passed to the CDF are integer minutes within a small range, so the CDF of each of them up to the
+        # largest delay of the distribution is computed once
+        n_tabulated = 0 if len(times) == 0 else min(max(self._sorted_times[-1] + 1, 0), MAX_TABULATED_DELAY + 1)
+        self._cdf_by_minute = [self._search_cdf(delay) for delay in range(n_tabulated)]
+
     def __str__(self):
         return 'Distribution [{}], {} values'.format(self.id, len(self.times))
 
@@ -45,8 +63,30 @@ class Distribution(object):
         Returns
         =======
         float
-            Probability of having a delay less or equal to the given delay.
+            Probability of having a delay less or equal to the given delay. As delays are never negative, this is 0
+            for a negative delay (a connection that is missed even if the trip is on time).
         """
+        if isinstance(delay, int) and 0 <= delay < len(self._cdf_by_minute):
+            return self._cdf_by_minute[delay]
         if delay < 0:
-            raise VaueError("The delay of a CDF has to be non-negative, got {}".format(delay))
-        return sum([self.probas[i] for i, t in enumerate(self.times) if t <= delay], 0)
+            return 0.0
+        return self._search_cdf(delay)
+
+    def _search_cdf(self, delay: int):
+        """
+        Calculates the CDF of having at most the given delay with a binary search over the delays
+
+        Argument
+        ========
+        delay : int
+            Delay in minutes
+
+        Returns
+        =======
+        float
+            Probability of having a delay less or equal to the given delay.
+        """
+        n_delays = bisect_right(self._sorted_times, delay)
+        if n_delays == 0:
+            return 0
+        return self._cum_probas[n_delays - 1]
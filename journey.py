@@ -1,8 +1,12 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import List, Union, Optional, Tuple, Dict
 
-from connections import Footpath, TripSegment
+from connections import Footpath, TripSegment, FOOTPATH, TRIP_SEGMENT
 from distribution import Distribution
+from time_utils import from_minutes
+
+# Value of the cached attributes of a Journey that were not computed yet (None is a valid value for some of them)
+_NOT_COMPUTED = object()
 
 
 class Journey(object):
@@ -20,20 +24,26 @@ class Journey(object):
     - :class:`int` current_arrival_stop --> The index of the train stop where the journey currently ends
     - :class:`bool` reached_destination --> Whether the arrival was reached (arrival_stop == current_arrival_stop)
     - :class:`bool` reached_destination --> Whether the arrival was reached (arrival_stop == current_arrival_stop)
-    - :class:`datetime.datetime` target_arr_time --> The latest time at which the passenger wanted to get to the end
+    - :class:`int` target_arr_time --> The latest time at which the passenger wanted to get to the end, in minutes since
+        the epoch
     - :class:`int` min_connection_time --> The minimum amount of time, in minutes, to "change tracks" at a stop
     - :class:`Dict[int, Distribution]` delay_distributions --> Distribution ids of trips to their delay distributions
     """
 
+    __slots__ = ('journey_segments', 'departure_stop', 'arrival_stop', 'current_arrival_stop', 'reached_destination',
+                 'min_connection_time', 'precomputed_changes', 'chance_of_success', 'delay_distributions',
+                 '_departure_time', '_arrival_time', '_target_arr_time', '_walk_time', '_fingerprint')
+
     def __init__(self,
                  departure_stop: int,
                  arrival_stop: int,
                  journey_segments: List[Union[Footpath, TripSegment]],
-                 target_arrival_time: datetime,
-                 min_connection_time: timedelta,
+                 target_arrival_time: int,
+                 min_connection_time: int,
                  delay_distributions: Dict[int, Distribution],
-                 arrival_time_at_last_stop: Optional[float],
-                 success_probability: Optional[float]):
+                 arrival_time_at_last_stop: Optional[int],
+                 success_probability: Optional[float],
+                 walk_time: Optional[int] = None):
 
         self.journey_segments = journey_segments
         self.departure_stop = departure_stop
@@ -42,7 +52,7 @@ class Journey(object):
         if len(self.journey_segments) == 0:
             self.current_arrival_stop = departure_stop
         else:
-            if isinstance(self.journey_segments[-1], Footpath):
+            if self.journey_segments[-1].kind == FOOTPATH:
                 self.current_arrival_stop = self.journey_segments[-1].arr_stop
             else:
                 self.current_arrival_stop = self.journey_segments[-1].exit_connection.arr_stop
@@ -63,13 +73,18 @@ class Journey(object):
         self.delay_distributions = delay_distributions
 
         # Private variables
-        self._departure_time = False, None
+        self._departure_time = _NOT_COMPUTED
         if arrival_time_at_last_stop is not None:
-            self._arrival_time = True, arrival_time_at_last_stop
+            self._arrival_time = arrival_time_at_last_stop
         else:
-            self._arrival_time = False, None
+            self._arrival_time = _NOT_COMPUTED
         self._target_arr_time = target_arrival_time
-        self._walk_time = False, None
+        # The total walking time is kept up to date by add_segment_to_journey, and computed from the segments otherwise
+        if walk_time is not None:
+            self._walk_time = walk_time
+        else:
+            self._walk_time = sum(segment.walk_min for segment in journey_segments if segment.kind == FOOTPATH)
+        self._fingerprint = _NOT_COMPUTED
 
     def __len__(self):
         return len(self.journey_segments)
@@ -77,98 +92,137 @@ class Journey(object):
     def __repr__(self):
         return f'<Journey of {len(self)} segments>'
 
+    def __eq__(self, other):
+        if not isinstance(other, Journey):
+            return NotImplemented
+        return self.fingerprint() == other.fingerprint()
+
+    def __hash__(self):
+        return hash(self.fingerprint())
+
     def __str__(self):
-        s = f'Journey of {len(self)} segments, departs={self.departure_time()}, arrives={self.current_arrival_time()}'
-        for p in self.journey_segments:
-            s += f'\n    {str(p)}'
-        return s
+        header = f'Journey of {len(self)} segments, ' \
+                 f'departs={self.departure_time()}, arrives={self.current_arrival_time()}'
+        return '\n    '.join([header] + [str(p) for p in self.journey_segments])
 
     def departure_time(self) -> Optional[datetime]:
         """
         :return: the time at which the passenger needs to leave the starting point. None if unknown.
         """
-        if self._departure_time[0]:
-            return self._departure_time[1]
+        dep_min = self.departure_min()
+        return None if dep_min is None else from_minutes(dep_min)
 
-        if len(self.journey_segments) == 0:
-            self._departure_time = (True, None)
+    def departure_min(self) -> Optional[int]:
+        """
+        :return: the time at which the passenger needs to leave the starting point, in minutes since the epoch. None if
+            unknown.
+        """
+        if self._departure_time is not _NOT_COMPUTED:
+            return self._departure_time
+
+        segments = self.journey_segments
+        if len(segments) == 0:
+            self._departure_time = None
             return None
 
-        if isinstance(self.journey_segments[0], Footpath):
-            if len(self.journey_segments) == 1:
-                self._departure_time = (True, None)
-                return self.target_arrival_time() - self.journey_segments[0].walk_time
+        first_segment = segments[0]
+        if first_segment.kind == FOOTPATH:
+            if len(segments) == 1:
+                self._departure_time = None
+                return self._target_arr_time - first_segment.walk_min
             else:
-                if not isinstance(self.journey_segments[1], TripSegment):
-                    raise ValueError(f'Two Footpaths in a row in a Journey: {self.journey_segments}')
-                dep_time = self.journey_segments[1].departure_time - self.journey_segments[0].walk_time
-                self._departure_time = (True, dep_time)
+                if segments[1].kind != TRIP_SEGMENT:
+                    raise ValueError(f'Two Footpaths in a row in a Journey: {segments}')
+                dep_time = segments[1].departure_min - first_segment.walk_min
+                self._departure_time = dep_time
                 return dep_time
         else:
-            self._departure_time = (True, self.journey_segments[0].departure_time)
-            return self._departure_time[1]
+            self._departure_time = first_segment.departure_min
+            return self._departure_time
 
     def current_arrival_time(self) -> Optional[datetime]:
         """
         :return: The time at which the passenger arrives at the current last stop. None if unknown.
         """
-        if self._arrival_time[0]:
-            return self._arrival_time[1]
+        arr_min = self.current_arrival_min()
+        return None if arr_min is None else from_minutes(arr_min)
 
-        if len(self.journey_segments) == 0:
-            self._arrival_time = (True, None)
+    def current_arrival_min(self) -> Optional[int]:
+        """
+        :return: The time at which the passenger arrives at the current last stop, in minutes since the epoch. None if
+            unknown.
+        """
+        if self._arrival_time is not _NOT_COMPUTED:
+            return self._arrival_time
+
+        segments = self.journey_segments
+        if len(segments) == 0:
+            self._arrival_time = None
             return None
 
-        if isinstance(self.journey_segments[-1], Footpath):
+        last_segment = segments[-1]
+        if last_segment.kind == FOOTPATH:
 
-            if len(self.journey_segments) == 1:
+            if len(segments) == 1:
                 if self.reached_destination:
-                    self._arrival_time = (True, self.target_arrival_time())
-                    return self.target_arrival_time()
+                    self._arrival_time = self._target_arr_time
+                    return self._target_arr_time
                 else:
-                    self._arrival_time = (True, None)
+                    self._arrival_time = None
                     return None
 
             else:
-                if not isinstance(self.journey_segments[-2], TripSegment):
-                    raise ValueError(f'Two Footpaths in a row in a Journey: {self.journey_segments}')
+                if segments[-2].kind != TRIP_SEGMENT:
+                    raise ValueError(f'Two Footpaths in a row in a Journey: {segments}')
 
-                arr_time = self.journey_segments[-2].arrival_time + self.journey_segments[-1].walk_time
-                self._arrival_time = (True, arr_time)
-                return self._arrival_time[1]
+                arr_time = segments[-2].arrival_min + last_segment.walk_min
+                self._arrival_time = arr_time
+                return self._arrival_time
 
         else:
-            arr_time = self.journey_segments[-1].arrival_time
-            self._arrival_time = (True, arr_time)
-            return self._arrival_time[1]
+            arr_time = last_segment.arrival_min
+            self._arrival_time = arr_time
+            return self._arrival_time
 
     def target_arrival_time(self) -> datetime:
         """
         :return: the time at which the passenger wants to arrive at the destination
         """
+        return from_minutes(self._target_arr_time)
+
+    def target_arrival_min(self) -> int:
+        """
+        :return: the time at which the passenger wants to arrive at the destination, in minutes since the epoch
+        """
         return self._target_arr_time
 
     def duration(self) -> int:
         """
         :return: The current journey duration, in minutes
         """
-        time_diff = (self.current_arrival_time() - self.departure_time()).seconds
-        return (time_diff // 60) + int(time_diff % 60 > 0)
+        return self.current_arrival_min() - self.departure_min()
 
     def walk_time(self) -> int:
         """
         :return: The amount of time that needs to be spent walking during the journey
         """
-        if self._walk_time[0]:
-            return self._walk_time[1]
+        return self._walk_time
 
-        time: int = 0
-        for segment in self.journey_segments:
-            if isinstance(segment, Footpath):
-                time += (segment.walk_time.seconds // 60)
+    def fingerprint(self) -> Tuple:
+        """
+        :return: a hashable summary of the journey, used to compare journeys. Journeys with the same fingerprint go
+            between the same stops, for the same target arrival time, taking the same trips and footpaths.
+        """
+        if self._fingerprint is not _NOT_COMPUTED:
+            return self._fingerprint
 
-        self._walk_time = True, time
-        return time
+        segments = tuple(
+            (FOOTPATH, segment.dep_stop, segment.arr_stop, segment.walk_min) if segment.kind == FOOTPATH else
+            (TRIP_SEGMENT, segment.trip_id, segment.entry_stop(), segment.exit_stop())
+            for segment in self.journey_segments
+        )
+        self._fingerprint = (self.departure_stop, self.arrival_stop, self._target_arr_time, segments)
+        return self._fingerprint
 
     def success_probability(self) -> float:
         """
@@ -179,35 +233,39 @@ class Journey(object):
     def changes(self) -> List[Tuple[TripSegment, int]]:
         """
         :return: an iterable outputting trip segments and the maximum delay that can occur during the journey for the
-        passenger not to miss the next trip.
+        passenger not to miss the next trip. The delays are never negative: a change that cannot be made has no
+        margin for delay at all.
         """
         if self.precomputed_changes is not None:
             return self.precomputed_changes
 
         changes = []
-        for i, segment in enumerate(self.journey_segments):
-            if isinstance(segment, TripSegment):
+        segments = self.journey_segments
+        n_segments = len(segments)
+        for i in range(n_segments):
+            segment = segments[i]
+            if segment.kind == TRIP_SEGMENT:
                 # If this segment is the last one before arriving at the destination, the amount of delay that can occur
                 # is the amount of time between the arrival and the time the person needs to be at the destination
-                if i == len(self.journey_segments) - 1:
-                    max_delay = (self.target_arrival_time() - segment.exit_connection.arr_time).seconds // 60
+                if i == n_segments - 1:
+                    max_delay = max(0, self._target_arr_time - segment.exit_connection.arr_min)
                     changes.append((segment, max_delay))
 
                 # Same if it is the segment before last but we need to walk
-                elif i == len(self.journey_segments) - 2 and isinstance(self.journey_segments[-1], Footpath):
-                    arr_time_plus_walk_time = segment.exit_connection.arr_time + self.journey_segments[-1].walk_time
-                    max_delay = (self.target_arrival_time() - arr_time_plus_walk_time).seconds // 60
+                elif i == n_segments - 2 and segments[-1].kind == FOOTPATH:
+                    arr_time_plus_walk_time = segment.exit_connection.arr_min + segments[-1].walk_min
+                    max_delay = max(0, self._target_arr_time - arr_time_plus_walk_time)
                     changes.append((segment, max_delay))
                 # Otherwise, it's the difference between the arrival time of this connection and the departure time of
                 # the next, minus the walking time
                 else:
-                    next_stop_arr_time = segment.exit_connection.arr_time
+                    next_stop_arr_time = segment.exit_connection.arr_min
                     next_connection_index = i + 1
-                    if isinstance(self.journey_segments[i + 1], Footpath):
-                        next_stop_arr_time += self.journey_segments[i + 1].walk_time
+                    if segments[i + 1].kind == FOOTPATH:
+                        next_stop_arr_time += segments[i + 1].walk_min
                         next_connection_index += 1
-                    next_connection_dep = self.journey_segments[next_connection_index].enter_connection.dep_time
-                    max_delay = (next_connection_dep - next_stop_arr_time).seconds//60
+                    next_connection_dep = segments[next_connection_index].enter_connection.dep_min
+                    max_delay = max(0, next_connection_dep - next_stop_arr_time)
                     changes.append((segment, max_delay))
 
         self.precomputed_changes = changes
@@ -227,58 +285,62 @@ def add_segment_to_journey(j: Journey, new_segment: Union[Footpath, TripSegment]
     new_journey_segments.append(new_segment)
     new_success_probability = j.success_probability()
     new_arrival_time_at_last_stop = None
+    new_walk_time = j.walk_time()
+
+    if new_segment.kind == FOOTPATH:
+        new_walk_time += new_segment.walk_min
 
-    if isinstance(new_segment, Footpath):
         # If we haven't arrived, we don't know at what time the next connection is yet.
         # Otherwise we know at what time we needed to be there
         if new_segment.arr_stop == j.arrival_stop:
             # If the journey didn't have an arrival time, then the chance of making this trip is 1.
             # Otherwise we need to compute the probability to arrive at the destination in time
-            if j.current_arrival_time() is not None:
-                time_to_arrive = j.current_arrival_time() + new_segment.walk_time
-                max_delay = (j.target_arrival_time() - time_to_arrive).seconds // 60
+            if j.current_arrival_min() is not None:
+                time_to_arrive = j.current_arrival_min() + new_segment.walk_min
+                max_delay = j.target_arrival_min() - time_to_arrive
                 # The probability to arrive in time is based on the probability distribution of the last trip segment
                 previous_trip = j.journey_segments[-1]
-                last_trip_distribution = j.delay_distributions.get(previous_trip.delay_distribution_id())
+                last_trip_distribution = j.delay_distributions.get(previous_trip.distribution_id)
                 new_success_probability = new_success_probability * last_trip_distribution.cdf(max_delay)
 
-                new_arrival_time_at_last_stop = previous_trip.arrival_time + new_segment.walk_time
+                new_arrival_time_at_last_stop = previous_trip.arrival_min + new_segment.walk_min
             else:
                 # If we didn't have a minimum arrival time, than we can arrive at the last stop at the target
-                new_arrival_time_at_last_stop = j.target_arrival_time()
+                new_arrival_time_at_last_stop = j.target_arrival_min()
 
     else:
         # Compute the probability of arriving at the stop before the connection leaves.
         # 1 if there is no current arrival time for the journey
-        if j.current_arrival_time() is not None:
-            if isinstance(j.journey_segments[-1], TripSegment):
+        if j.current_arrival_min() is not None:
+            if j.journey_segments[-1].kind == TRIP_SEGMENT:
                 previous_trip = j.journey_segments[-1]
-                arrival_time_at_new_connection = previous_trip.arrival_time
+                arrival_time_at_new_connection = previous_trip.arrival_min
             else:
                 previous_trip = j.journey_segments[-2]
-                arrival_time_at_new_connection = previous_trip.arrival_time + j.journey_segments[-1].walk_time
+                arrival_time_at_new_connection = previous_trip.arrival_min + j.journey_segments[-1].walk_min
 
-            last_trip_distribution = j.delay_distributions.get(previous_trip.delay_distribution_id())
-            max_delay = (new_segment.departure_time - arrival_time_at_new_connection).seconds // 60
+            last_trip_distribution = j.delay_distributions.get(previous_trip.distribution_id)
+            max_delay = new_segment.departure_min - arrival_time_at_new_connection
             new_success_probability *= last_trip_distribution.cdf(max_delay)
 
         # If this is the last connection, compute the probability of arriving there in time
         if new_segment.exit_connection.arr_stop == j.arrival_stop:
-            trip_dist = j.delay_distributions.get(new_segment.delay_distribution_id())
-            max_delay = (j.target_arrival_time() - new_segment.arrival_time).seconds // 60
+            trip_dist = j.delay_distributions.get(new_segment.distribution_id)
+            max_delay = j.target_arrival_min() - new_segment.arrival_min
             new_success_probability *= trip_dist.cdf(max_delay)
 
-        new_arrival_time_at_last_stop = new_segment.arrival_time
+        new_arrival_time_at_last_stop = new_segment.arrival_min
 
     extended_journey = Journey(
         j.departure_stop,
         j.arrival_stop,
         new_journey_segments,
-        j.target_arrival_time(),
+        j.target_arrival_min(),
         j.min_connection_time,
         j.delay_distributions,
         new_arrival_time_at_last_stop,
         new_success_probability,
+        new_walk_time,
     )
 
     return extended_journey
@@ -1,32 +1,31 @@
 import math
-from datetime import datetime, timedelta
-from typing import Dict, List
+from itertools import islice
+from typing import Deque, Dict, List, Optional, Tuple
 
 from connections import TripSegment, Connection
 from distribution import Distribution
 from journey import Journey, add_segment_to_journey
-from journey_pointer import JourneyPointer
 from sorted_lists import SortedJourneyList
 
 
 def follow_path(journey_so_far: Journey,
-                previous_trips_taken: List,
+                previous_trips_taken: Tuple[int, ...],
                 destination: int,
-                journey_pointers: Dict[int, SortedJourneyList],
-                trip_connections: Dict[str, List[Connection]],
+                journey_pointers: List[SortedJourneyList],
+                trip_connections: List[Optional[Deque[Connection]]],
                 min_chance_of_success: float,
-                min_connection_time: timedelta,
+                min_connection_time: int,
                 max_recursion_depth: int) -> List[Journey]:
     """
     Given a Journey and a destination, recursively follows JourneyPointers to arrive to the destination.
 
     :param journey_so_far: the journey followed to arrive to the current stop
-    :param previous_trips_taken: a list containing the ids of the trips taken so far in the journey
+    :param previous_trips_taken: a tuple containing the codes of the trips taken so far in the journey
     :param destination: the stop where the traveller wants to go
-    :param journey_pointers: the journey pointers created by the Custom Connection Scan algorithm
-    :param trip_connections: maps trip_ids to the connections in the trip that can be taken
+    :param journey_pointers: the journey pointers created by the Custom Connection Scan algorithm, indexed by stop
+    :param trip_connections: the connections in each trip that can be taken, indexed by trip code
     :param min_chance_of_success: the minimum probability of success this journey should have to be kept
-    :param min_connection_time: the minimum amount needed to switch trains at a station
+    :param min_connection_time: the minimum amount of minutes needed to switch trains at a station
     :param max_recursion_depth: the maximum number of segments that can be in a journey
     :return: the possible Journeys to get from the source to the destination in time
     """
@@ -34,7 +33,7 @@ def follow_path(journey_so_far: Journey,
         return []
 
     starting_stop = journey_so_far.current_arrival_stop
-    arrival_time_at_starting_stop = journey_so_far.current_arrival_time()
+    arrival_time_at_starting_stop = journey_so_far.current_arrival_min()
 
     # If the journey was too long, return
     if len(journey_so_far) > max_recursion_depth:
@@ -45,14 +44,18 @@ def follow_path(journey_so_far: Journey,
         return [journey_so_far]
 
     paths_from_here = []
-    possible_paths = journey_pointers.get(starting_stop, [])
+    possible_paths = journey_pointers[starting_stop]
     for p in possible_paths:
         # Compute the time you need to arrive at the stop to take this path
         latest_arrival_time = p.arrival_time
 
-        # Check that you're at the input early enough to make it, and that you're not getting onto a trip you got off of
-        if ((arrival_time_at_starting_stop is None or arrival_time_at_starting_stop <= latest_arrival_time) and
-                (p.enter_connection is None or p.enter_connection.trip_id not in previous_trips_taken)):
+        # Check that you're at the input early enough to make it. The journey pointers are sorted in descending order of
+        # arrival time, so if you arrive too late for this path, you also arrive too late for all the following ones.
+        if arrival_time_at_starting_stop is not None and arrival_time_at_starting_stop > latest_arrival_time:
+            break
+
+        # Check that you're not getting onto a trip you got off of
+        if p.enter_connection is None or p.enter_connection.trip_code not in previous_trips_taken:
 
             new_journey = journey_so_far
 
@@ -60,62 +63,80 @@ def follow_path(journey_so_far: Journey,
             walked_to_end = False
 
             # If you need to walk to a stop, walk to a stop
-            if p.footpath is not None:
-                new_journey = add_segment_to_journey(new_journey, p.footpath)
+            if p.walk_min is not None:
+                footpath = p.footpath(starting_stop, destination)
+                new_journey = add_segment_to_journey(new_journey, footpath)
 
                 # If you've walked to the end, set the flag to true
-                if p.footpath.arr_stop == destination:
+                if footpath.arr_stop == destination:
                     if new_journey.success_probability() < min_chance_of_success:
                         return []
                     else:
-                        paths_from_here += [new_journey]
+                        paths_from_here.append(new_journey)
                     walked_to_end = True
 
             # If you didn't walk to the end, check if you can take alternative routes or how to continue your journey
             if not walked_to_end and p.enter_connection is not None:
 
                 # Add the trip we are taking to the trips taken
-                previous_trips_taken = previous_trips_taken + [p.enter_connection.trip_id]
+                previous_trips_taken = previous_trips_taken + (p.enter_connection.trip_code,)
 
                 # Look at the connections found on the trip
-                connections = trip_connections.get(p.enter_connection.trip_id)
+                connections = trip_connections[p.enter_connection.trip_code]
 
                 if connections is None:
                     raise ValueError(f'Missing value in trip_connections for trip {p.enter_connection.trip_id}')
 
-                # Check if alternative routes are available by getting out before the exit connection
-                found_entry_connection = False
-                found_exit_connection = False
-                for c in connections:
-                    if c == p.exit_connection:
-                        found_exit_connection = True
-
-                    if found_entry_connection and not found_exit_connection:
-                        c_possible_paths: List[JourneyPointer] = journey_pointers.get(c.arr_stop, [])
+                # Check if alternative routes are available by getting out after the entry connection and before the
+                # exit connection. Getting out adds a segment to the journey, so there are none if the journey is
+                # already as long as it can be. The connections of the trip are in order of departure, and their
+                # positions are counted from the back.
+                alt_journey_base_length = len(new_journey) + 1
+                target_arrival_time = journey_so_far.target_arrival_min()
+                if alt_journey_base_length <= max_recursion_depth:
+                    last_index = len(connections) - 1
+                    entry_index = last_index - p.enter_connection.trip_position
+                    exit_index = last_index - p.exit_connection.trip_position
+                    for c in islice(connections, entry_index + 1, exit_index):
+                        c_possible_paths: SortedJourneyList = journey_pointers[c.arr_stop]
                         if len(c_possible_paths) > 1:
+                            # The alternative connections must leave at least min_connection_time after c arrives
+                            c_trip_code = c.trip_code
+                            earliest_alt_departure = c.arr_min + min_connection_time
                             for alt_journey_pointer in c_possible_paths:
+                                alt_enter_connection = alt_journey_pointer.enter_connection
+                                alt_walk_min = alt_journey_pointer.walk_min
+
                                 # Check that the alternative route takes another trip, as we don't want to get off and
                                 # immediately get back on a trip (if the connections are None than this edge was
                                 # discovered during initialization and it arrives at the destination)
                                 alt_journey_on_another_line = (
-                                        alt_journey_pointer.enter_connection is None or
-                                        alt_journey_pointer.enter_connection.trip_id != c.trip_id
+                                        alt_enter_connection is None or
+                                        alt_enter_connection.trip_code != c_trip_code
                                 )
 
                                 # Check that there is enough time to catch the alternative connection (walking to
-                                # the alternative stop and connection time)
-                                alt_journey_starts_with_walk = alt_journey_pointer.footpath is not None
-
-                                time_to_alt_stop = min_connection_time
-                                if alt_journey_starts_with_walk:
-                                    time_to_alt_stop += alt_journey_pointer.footpath.walk_time
+                                # the alternative stop and connection time), or to walk to the destination before the
+                                # target arrival time if the alternative route ends there
+                                alt_journey_starts_with_walk = alt_walk_min is not None
+                                alt_walk = alt_walk_min if alt_journey_starts_with_walk else 0
+
+                                if alt_enter_connection is None:
+                                    alt_journey_can_be_taken = c.arr_min + alt_walk <= target_arrival_time
+                                else:
+                                    alt_journey_can_be_taken = (
+                                        alt_enter_connection.dep_min >= earliest_alt_departure + alt_walk
+                                    )
 
-                                alt_journey_can_be_taken = (
-                                    alt_journey_pointer.enter_connection is None or
-                                    alt_journey_pointer.enter_connection.dep_time >= c.arr_time + time_to_alt_stop
+                                # The alternative may then walk and take another trip: skip it if this makes the
+                                # journey too long to be followed
+                                alt_journey_length = (
+                                    alt_journey_base_length + alt_journey_starts_with_walk +
+                                    (alt_enter_connection is not None)
                                 )
 
-                                if alt_journey_on_another_line and alt_journey_can_be_taken:
+                                if (alt_journey_on_another_line and alt_journey_can_be_taken and
+                                        alt_journey_length <= max_recursion_depth):
 
                                     # Get out of the trip at c
                                     alt_trip_segment = TripSegment(p.enter_connection, c)
@@ -125,14 +146,14 @@ def follow_path(journey_so_far: Journey,
                                     # Walk if you need to
                                     if alt_journey_starts_with_walk:
                                         alt_journey = add_segment_to_journey(
-                                            alt_journey, alt_journey_pointer.footpath
+                                            alt_journey, alt_journey_pointer.footpath(c.arr_stop, destination)
                                         )
 
                                     alt_previous_trips_taken = previous_trips_taken
                                     # take a train if you need to
-                                    if alt_journey_pointer.enter_connection is not None:
+                                    if alt_enter_connection is not None:
                                         alt_train_segment = TripSegment(
-                                            alt_journey_pointer.enter_connection,
+                                            alt_enter_connection,
                                             alt_journey_pointer.exit_connection
                                         )
 
@@ -140,41 +161,43 @@ def follow_path(journey_so_far: Journey,
                                             alt_journey, alt_train_segment
                                         )
 
-                                        alt_previous_trips_taken = previous_trips_taken + [alt_train_segment.trip_id]
-
-                                    # Take the alternative route
-                                    next_stop_ends = follow_path(
-                                        alt_journey,
-                                        alt_previous_trips_taken,
-                                        destination,
-                                        journey_pointers,
-                                        trip_connections,
-                                        min_chance_of_success,
-                                        min_connection_time,
-                                        max_recursion_depth
-                                    )
-                                    paths_from_here += next_stop_ends
-
-                    if c == p.enter_connection:
-                        found_entry_connection = True
-
-                # Take the normal connection to the next stop
-                trip_segment = TripSegment(p.enter_connection, p.exit_connection)
-                new_journey = add_segment_to_journey(
-                    new_journey, trip_segment
-                )
-                # Follow the path from the next stop
-                next_stop_ends = follow_path(
-                    new_journey,
-                    previous_trips_taken,
-                    destination,
-                    journey_pointers,
-                    trip_connections,
-                    min_chance_of_success,
-                    min_connection_time,
-                    max_recursion_depth
-                )
-                paths_from_here += next_stop_ends
+                                        alt_previous_trips_taken = (
+                                            previous_trips_taken + (alt_enter_connection.trip_code,)
+                                        )
+
+                                    # Take the alternative route, unless it is already too unlikely to succeed
+                                    if alt_journey.success_probability() >= min_chance_of_success:
+                                        next_stop_ends = follow_path(
+                                            alt_journey,
+                                            alt_previous_trips_taken,
+                                            destination,
+                                            journey_pointers,
+                                            trip_connections,
+                                            min_chance_of_success,
+                                            min_connection_time,
+                                            max_recursion_depth
+                                        )
+                                        paths_from_here.extend(next_stop_ends)
+
+                # Take the normal connection to the next stop, unless that makes the journey too long to be followed
+                if len(new_journey) < max_recursion_depth:
+                    trip_segment = TripSegment(p.enter_connection, p.exit_connection)
+                    new_journey = add_segment_to_journey(
+                        new_journey, trip_segment
+                    )
+                    # Follow the path from the next stop, unless the journey is already too unlikely to succeed
+                    if new_journey.success_probability() >= min_chance_of_success:
+                        next_stop_ends = follow_path(
+                            new_journey,
+                            previous_trips_taken,
+                            destination,
+                            journey_pointers,
+                            trip_connections,
+                            min_chance_of_success,
+                            min_connection_time,
+                            max_recursion_depth
+                        )
+                        paths_from_here.extend(next_stop_ends)
     return paths_from_here
 
 
@@ -189,7 +212,7 @@ def sort_journeys(journeys: List[Journey]) -> List[Journey]:
     :param journeys: the journeys to sort
     :return: the sorted journeys
     """
-    return sorted(journeys, key=lambda j: (j.departure_time(),
+    return sorted(journeys, key=lambda j: (j.departure_min(),
                                            -j.walk_time(),
                                            -len(j),
                                            j.success_probability()), reverse=True)
@@ -197,10 +220,10 @@ def sort_journeys(journeys: List[Journey]) -> List[Journey]:
 
 def find_resulting_paths(source: int,
                          destination: int,
-                         target_arrival: datetime,
+                         target_arrival: int,
                          min_connection_time: int,
-                         journey_pointers: Dict[int, SortedJourneyList],
-                         trip_connections: Dict[str, List[Connection]],
+                         journey_pointers: List[SortedJourneyList],
+                         trip_connections: List[Optional[Deque[Connection]]],
                          delay_distributions: Dict[int, Distribution],
                          min_chance_of_success: float,
                          max_recursion_depth: int) -> List[Journey]:
@@ -209,16 +232,16 @@ def find_resulting_paths(source: int,
 
     :param source: the stop from which the traveller starts
     :param destination: the stop where the traveller wants to go
-    :param target_arrival: the time at which the traveller needs to get there
+    :param target_arrival: the time at which the traveller needs to get there, in minutes since the epoch
     :param min_connection_time: the minimum amount of time needed to change trains
-    :param journey_pointers: the journey pointers created by the Custom Connection Scan algorithm
-    :param trip_connections: maps trip ids to the connections in the trip that can be taken
+    :param journey_pointers: the journey pointers created by the Custom Connection Scan algorithm, indexed by stop
+    :param trip_connections: the connections in each trip that can be taken, indexed by trip code
     :param delay_distributions: maps distribution delay groups to their distributions
     :param min_chance_of_success: the minimum probability of success a journey should have to be kept
     :param max_recursion_depth: the maximum number of segments that can be in a journey
     :return: the possible Journeys to get from the source to the destination in time
     """
-    min_co_time = timedelta(minutes=math.ceil(min_connection_time))
+    min_co_time = math.ceil(min_connection_time)
     start_journey = Journey(
         source,
         destination,
@@ -229,13 +252,15 @@ def find_resulting_paths(source: int,
         arrival_time_at_last_stop=None,
         success_probability=1.0,
     )
-    return sort_journeys(follow_path(
+    journeys = follow_path(
         start_journey,
-        [],
+        (),
         destination,
         journey_pointers,
         trip_connections,
         min_chance_of_success,
         min_co_time,
         max_recursion_depth,
-    ))
+    )
+    # Alternative routes can lead to the same journey: only keep it once (journeys compare by fingerprint)
+    return sort_journeys(list(dict.fromkeys(journeys)))
@@ -1,7 +1,7 @@
-from datetime import datetime
 from typing import Optional
 
 from connections import Connection, Footpath
+from time_utils import from_minutes
 
 
 class JourneyPointer(object):
@@ -9,29 +9,48 @@ class JourneyPointer(object):
     Pointers used to reconstruct the journey from the source to the sink
 
     Attributes:
-    - :class:`datetime` arrival_time --> The latest time at which someone can
-        arrive at the stop to make the connection.
+    - :class:`int` arrival_time --> The latest time at which someone can
+        arrive at the stop to make the connection, in minutes since the epoch.
     - :class:`Optional[Connection]` enter_connection --> If none, then this
         journey is a simple walk from a node to the sink. Otherwise, this is
         the connection from the
     - :class:`Optional[Connection]` exit_connection --> The name of the test object
-    - :class:`Footpath` footpath --> The name of the test object
+    - :class:`Optional[int]` walk_min --> If not None, the time in minutes it
+        takes to walk from the stop to the departure of enter_connection (or to
+        the sink). The Footpath itself is only built when it is needed, with
+        footpath(*).
     """
 
+    __slots__ = ('arrival_time', 'enter_connection', 'exit_connection', 'walk_min')
+
     def __init__(self,
-                 arrival_time: datetime,
+                 arrival_time: int,
                  enter_connection: Optional[Connection],
                  exit_connection: Optional[Connection],
-                 footpath: Optional[Footpath]):
+                 walk_min: Optional[int]):
 
         self.arrival_time = arrival_time
         self.enter_connection = enter_connection
         self.exit_connection = exit_connection
-        self.footpath = footpath
+        self.walk_min = walk_min
 
     def __repr__(self):
-        return f'<JourneyPointer ({self.arrival_time.time()}, {self.enter_connection}, ' \
-               f'{self.exit_connection}, {self.footpath})>'
+        return f'<JourneyPointer ({from_minutes(self.arrival_time).time()}, {self.enter_connection}, ' \
+               f'{self.exit_connection}, {self.walk_min})>'
 
     def __str__(self):
-        return f'({self.arrival_time.time()}, {self.enter_connection}, {self.exit_connection}, {self.footpath})'
+        return f'({from_minutes(self.arrival_time).time()}, {self.enter_connection}, {self.exit_connection}, ' \
+               f'{self.walk_min})'
+
+    def footpath(self, stop: int, sink: int) -> Optional[Footpath]:
+        """
+        Builds the footpath to walk before taking enter_connection, or to reach the sink if there is no connection.
+
+        :param stop: the stop at which this pointer is stored, where the footpath starts
+        :param sink: the stop where the journey ends
+        :return: the Footpath, or None if there is no need to walk
+        """
+        if self.walk_min is None:
+            return None
+        arr_stop = sink if self.enter_connection is None else self.enter_connection.dep_stop
+        return Footpath(stop, arr_stop, self.walk_min)
@@ -4,10 +4,18 @@ from journey_pointer import JourneyPointer
 
 
 class SortedJourneyList(object):
-    """ List of JourneyPointer, sorted in descending order of arrival time """
+    """
+    List of JourneyPointer, sorted in descending order of arrival time
+
+    The arrival times are also stored in a parallel list, arrival_times, so that they can be compared without going
+    through the JourneyPointer objects.
+    """
+
+    __slots__ = ('data', 'arrival_times')
 
     def __init__(self, data: List[JourneyPointer]):
         self.data = data
+        self.arrival_times = [p.arrival_time for p in data]
 
     def __len__(self):
         return len(self.data)
@@ -27,12 +35,44 @@ class SortedJourneyList(object):
 
         :param e: the element to add
         """
-        for i, elem in enumerate(self.data):
-            if elem.arrival_time <= e.arrival_time:
-                self.data = self.data[:i] + [e] + self.data[i:]
-                return
-        self.data = self.data + [e]
+        # Insert e before the first element arriving at the same time or earlier. The lists hold a handful of elements
+        # (journeys_per_stop), for which a plain loop over the arrival times is faster than a binary search. The
+        # connections are scanned in descending order of departure time, so e usually arrives earlier than all the
+        # elements of the list: search from the end
+        arrival_times = self.arrival_times
+        arrival_time = e.arrival_time
+        i = len(arrival_times)
+        while i > 0 and arrival_times[i - 1] <= arrival_time:
+            i -= 1
+        self.data.insert(i, e)
+        arrival_times.insert(i, arrival_time)
+
+    def accepts(self, arrival_time: int, max_size: int) -> bool:
+        """
+        Checks whether a JourneyPointer arriving at the given time should be added to a list holding at most max_size
+        elements: it is if the list is not full yet, or if it arrives no earlier than the earliest arrival of the list
+        (which it then replaces). Pointers that are rejected then do not need to be created.
+
+        :param arrival_time: the arrival time of the pointer, in minutes since the epoch
+        :param max_size: the maximum number of elements to keep in the list
+        :return: whether a pointer with this arrival time should be added with replace_or_insert
+        """
+        return max_size > 0 and (len(self.arrival_times) < max_size or arrival_time >= self.arrival_times[-1])
+
+    def replace_or_insert(self, e: JourneyPointer, max_size: int):
+        """
+        Adds a JourneyPointer that accepts() has already accepted, replacing the earliest arrival if the list is full.
+
+        :param e: the element to add
+        :param max_size: the maximum number of elements to keep in the list
+        """
+        if len(self.arrival_times) >= max_size:
+            # e arrives no earlier than the last element, so it is never inserted after it: remove the last element
+            # first, so that the list does not grow past max_size
+            self.remove_earliest_arrival()
+        self.append(e)
 
     def remove_earliest_arrival(self):
         """ Removes the journey pointer with the earliest arrival time in the list """
-        self.data = self.data[:-1]
+        self.data.pop()
+        self.arrival_times.pop()
@@ -1,4 +1,3 @@
-import random
 from datetime import datetime, timedelta
 
 import numpy as np
@@ -13,28 +12,30 @@ from distribution import Distribution
 ################################################################################################################
 
 
+START = datetime(year=2021, month=5, day=28, hour=12, minute=00)
+
+
 def time(minutes):
-    return datetime(year=2021, month=5, day=28, hour=12, minute=00) + timedelta(minutes=minutes)
+    return START + timedelta(minutes=minutes)
 
 
 # Generate Distributions
 ################################################################################################################
 
 
+rng = np.random.default_rng()
+
+
 def generate_integer_gaussian(mean_range=(0.75, 1.75), sigma_range=(1.5, 2.5), num_values=1000, max_delay=20):
-    mean = random.uniform(*mean_range)
-    sigma = random.uniform(*sigma_range)
-    values = max_delay * [0]
-    for _ in range(num_values):
-        v = random.gauss(mean, sigma)
-        if v > 0:
-            values[int(v)] += 1
-    return values
+    mean = rng.uniform(*mean_range)
+    sigma = rng.uniform(*sigma_range)
+    values = rng.normal(mean, sigma, num_values)
+    # Count the positive values by whole number of minutes
+    return np.bincount(values[values > 0].astype(np.int64), minlength=max_delay)[:max_delay]
 
 
 def probabilities(int_gaussian):
-    num_values = sum(int_gaussian)
-    return [v / num_values for v in int_gaussian]
+    return (int_gaussian / int_gaussian.sum()).tolist()
 
 
 list_distributions = []
@@ -52,30 +53,27 @@ delay_distributions = {i: d for i, d in list_distributions}
 ################################################################################################################
 
 
-# (ttype, dep_stop, arr_stop, dep_time, arr_time, trip, distribution_id)
-e_c = [
-    ['bus', 1, 3, time(15), time(18), '||', 0],
-    ['train', 1, 2, time(13), time(15), '| ', 1],
-    ['bus', 0, 1, time(10), time(15), '||', 0],
-    ['train', 4, 1, time(9), time(13), '| ', 1],
-    ['bus', 6, 0, time(8), time(10), '||', 0],
-    ['train', 5, 4, time(7), time(12), '| ', 1],
-]
-
-df_connections = pd.DataFrame(
-    e_c, columns=['route_desc', 'src_id', 'dst_id', 'departure_time_dt',
-                  'arrival_time_dt', 'trip_id', 'distribution_id']
-)
-
-footpaths = csr_matrix(np.array([
-    [0, 0, 0, 0, 0, 0, 0],
-    [0, 0, 0, 0, 0, 0, 0],
-    [0, 0, 0, 2, 0, 0, 0],
-    [0, 0, 2, 0, 0, 0, 0],
-    [0, 0, 0, 0, 0, 0, 0],
-    [0, 0, 0, 0, 0, 0, 2],
-    [0, 0, 0, 0, 0, 2, 0],
-]))
+# The connections, in descending order of departure time, with times in minutes after START. Each column is built with
+# its final type, so that pandas does not need to infer it
+dep_minutes = [15, 13, 10, 9, 8, 7]
+arr_minutes = [18, 15, 15, 13, 10, 12]
+df_connections = pd.DataFrame({
+    'route_desc': pd.Categorical(['bus', 'train', 'bus', 'train', 'bus', 'train']),
+    'src_id': np.array([1, 1, 0, 4, 6, 5], dtype=np.int32),
+    'dst_id': np.array([3, 2, 1, 1, 0, 4], dtype=np.int32),
+    'departure_time_dt': pd.Timestamp(START) + pd.to_timedelta(dep_minutes, unit='m'),
+    'arrival_time_dt': pd.Timestamp(START) + pd.to_timedelta(arr_minutes, unit='m'),
+    'trip_id': pd.Categorical(['||', '| ', '||', '| ', '||', '| ']),
+    'distr_id': np.array([0, 1, 0, 1, 0, 1], dtype=np.int16),
+})
+
+# Walking times between stops: 2 <-> 3 and 5 <-> 6 take 2 minutes each. The matrix is built directly in CSR form, from
+# the walking times, the destination stop of each footpath, and where the footpaths of each stop start
+footpaths = csr_matrix((
+    np.array([2, 2, 2, 2]),
+    np.array([3, 2, 6, 5]),
+    np.array([0, 0, 0, 1, 2, 2, 3, 4]),
+), shape=(7, 7))
 
 source = 5
 destination = 3
@@ -116,3 +114,45 @@ for i, r in enumerate(results):
     for trip_seg, change_time in r.changes():
         print(f'  {trip_seg}: {change_time}min')
     print()
+
+
+# Regression: getting off a trip to walk to the destination
+################################################################################################################
+
+
+# Trip A goes 0 -> 1 -> 3 -> 2 and arrives at the destination 2 at 12:19. Getting off at 3 at 12:18 and walking the 5
+# minutes to 2 arrives at 12:23, after the target arrival time of 12:20: that alternative must not be kept (it used to
+# make the scan fail when computing its probability of success)
+regression_connections = pd.DataFrame({
+    'route_desc': pd.Categorical(['bus', 'bus', 'bus', 'bus']),
+    'src_id': np.array([3, 3, 1, 0], dtype=np.int32),
+    'dst_id': np.array([2, 2, 3, 1], dtype=np.int32),
+    'departure_time_dt': pd.Timestamp(START) + pd.to_timedelta([18, 13, 12, 10], unit='m'),
+    'arrival_time_dt': pd.Timestamp(START) + pd.to_timedelta([19, 14, 18, 12], unit='m'),
+    'trip_id': pd.Categorical(['A', 'B', 'A', 'A']),
+    'distr_id': np.array([0, 0, 0, 0], dtype=np.int16),
+})
+regression_footpaths = csr_matrix((
+    np.array([5, 5]),
+    np.array([3, 2]),
+    np.array([0, 0, 0, 1, 2]),
+), shape=(4, 4))
+
+regression_results = connection_scan(
+    regression_connections,
+    regression_footpaths,
+    delay_distributions,
+    source=0,
+    destination=2,
+    target_arrival=time(20),
+    time_per_connection=1,
+    journeys_to_find=5,
+    min_chance_of_success=0.0,
+    journeys_per_stop=2,
+    min_times_to_find_source=1,
+    max_recursion=8,
+)
+
+assert len(regression_results) == 1
+assert all(r.current_arrival_time() <= time(20) for r in regression_results)
+print('Regression scenario: OK')
@@ -0,0 +1,29 @@
+from datetime import datetime, timedelta, timezone
+
+# Times are represented internally as integer numbers of minutes elapsed since this (naive) epoch, so that time
+# arithmetic and comparisons are integer operations. Timezone-aware times are converted to UTC first, so the times
+# converted back with from_minutes are naive UTC times for them
+EPOCH = datetime(year=1970, month=1, day=1)
+ONE_MINUTE = timedelta(minutes=1)
+
+
+def to_minutes(t: datetime) -> int:
+    """
+    Converts a datetime to the number of minutes elapsed since the epoch, rounded down.
+
+    :param t: the datetime to convert. If it is timezone-aware, it is converted to UTC
+    :return: the number of minutes between the epoch and t
+    """
+    if t.tzinfo is not None:
+        t = t.astimezone(timezone.utc).replace(tzinfo=None)
+    return (t - EPOCH) // ONE_MINUTE
+
+
+def from_minutes(minutes: int) -> datetime:
+    """
+    Converts a number of minutes elapsed since the epoch back to a datetime.
+
+    :param minutes: the number of minutes since the epoch
+    :return: the corresponding datetime
+    """
+    return EPOCH + timedelta(minutes=minutes)